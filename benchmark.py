@@ -0,0 +1,208 @@
+# Import
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import library
+from eACO import e_library
+from eACO.protocol import argmax, fast_div
+from eACO.secret_matrix import SecretMatrix
+from eACO.stopwatch import Stopwatch
+from eACO.utils import encrypt_2darray, get_fp
+
+"""
+    Time a function, the best and the mean of several runs
+    @arg
+        {function} function     -- Function to time, called without arguments
+        {int} repeat {5}        -- Number of timed runs
+
+    @return
+        {dict}                  -- Best and mean seconds of the runs, and their number
+"""
+def timeIt(function, repeat = 5):
+    durations = []
+    for _ in range(repeat):
+        stopwatch = Stopwatch()
+        function()
+        stopwatch.stop()
+        durations.append(stopwatch.duration)
+
+    return {'seconds': min(durations), 'mean': sum(durations) / repeat, 'repeat': repeat}
+
+"""
+    Random space - Uniformly random nodes on the square of kroA100
+    @arg
+        {int} n                 -- Number of nodes
+        {int} seed {0}          -- Seed of the generator, the same seed gives the same instance
+
+    @return
+        {numpy.ndarray}         -- An n per 2 array of coordinates
+"""
+def randomSpace(n, seed = 0):
+    return np.random.default_rng(seed).uniform(0, 4000, size = (n, 2))
+
+"""
+    Micro benchmarks of the kernels of the plaintext and the encrypted algorithm
+    @arg
+        {int} n                 -- Number of nodes of the random instance
+        {int} colony {50}       -- Number of ants in the colony
+        {int} repeat {5}        -- Number of timed runs of each kernel
+
+    @return
+        {dict}                  -- Timing of each kernel, by name
+"""
+def microBenchmarks(n, colony = 50, repeat = 5):
+    # Same random instance and ants for every kernel
+    space = randomSpace(n)
+    np.random.seed(0)
+    inv_distances, distances = library.inverseDistances(space)
+    pheromones = np.ones((n, n))
+    choice_info = library.choiceInformation(pheromones, inv_distances, 1)
+    positions = library.initializeAnts(space, colony)
+    paths = library.moveAnts(space, positions, choice_info)
+    deposits = 1 / library.tourDistances(paths, distances)
+
+    # Encrypted row of probabilities and its total, as moved by one ant
+    e_row = SecretMatrix.share((inv_distances[0] * get_fp()).astype(np.int64))
+    e_total = SecretMatrix.share(int(inv_distances[0].sum() * get_fp()))
+    visited = np.zeros(n, dtype = bool)
+    visited[0] = True
+
+    # Pheromone update, evaporation then deposit on every edge of every path
+    def updatePheromones():
+        np.multiply(pheromones, 1 - 0.2, out = pheromones)
+        library.depositPheromones(pheromones, paths, deposits)
+
+    kernels = {
+        'inverseDistances': lambda: library.inverseDistances(space),
+        'moveAnts': lambda: library.moveAnts(space, positions, choice_info),
+        'pheromone update': updatePheromones,
+        'encrypt_2darray': lambda: encrypt_2darray(inv_distances),
+        'fast_div': lambda: fast_div(e_row * get_fp(), e_total),
+        'argmax': lambda: argmax(e_row, visited),
+    }
+
+    return {'{} n={}'.format(name, n): timeIt(kernel, repeat) for name, kernel in kernels.items()}
+
+"""
+    Macro benchmarks of whole runs of the plaintext and, optionally, the encrypted algorithm
+    @arg
+        {list} sizes                -- Numbers of nodes of the random instances
+        {int} iterations {10}       -- Number of iterations of each run
+        {int} colony {50}           -- Number of ants in the colony
+        {bool} encrypted {False}    -- Also run the encrypted algorithm on every instance
+        {int} workers {None}        -- Number of worker processes of the encrypted runs, the CPU count if None
+
+    @return
+        {dict}                      -- Timing and minimum distance of each run, by name
+"""
+def macroBenchmarks(sizes, iterations = 10, colony = 50, encrypted = False, workers = None):
+    # Stored instances, then random instances of increasing size
+    instances = {tsp: np.array(library.getTspData('data/{}.tsp'.format(tsp))['node_coord_section'])
+                 for tsp in ('berlin52', 'kroA100')}
+    instances.update({'random n={}'.format(n): randomSpace(n) for n in sizes})
+
+    # Algorithms to run on every instance
+    runs = {'runAcoTsp': lambda space: library.runAcoTsp(space, iterations, colony, 1, 5.0, 1.0, 0.2)}
+    if encrypted:
+        runs['e_runAcoTsp'] = lambda space: e_library.runAcoTsp(space, iterations, colony, workers = workers)
+
+    results = {}
+    for name, space in instances.items():
+        for run, function in runs.items():
+            np.random.seed(0)
+            # Keep the progress prints of the runs out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                stopwatch = Stopwatch()
+                min_path, min_distance = function(space)
+                stopwatch.stop()
+            results['{} {}'.format(run, name)] = {'seconds': stopwatch.duration, 'min_distance': float(min_distance)}
+
+    return results
+
+"""
+    Compare a report against a stored baseline
+    @arg
+        {dict} report           -- Report of this run
+        {dict} baseline         -- Stored report to compare against
+        {float} tolerance {0.1} -- Allowed relative slowdown before a benchmark is a regression
+
+    @return
+        {list}                  -- Regressions, with the name, the seconds of both reports and the ratio
+"""
+def compare(report, baseline, tolerance = 0.1):
+    regressions = []
+    for kind in ('micro', 'macro'):
+        for name, result in report.get(kind, {}).items():
+            # Benchmarks missing from the baseline cannot regress
+            stored = baseline.get(kind, {}).get(name)
+            if stored is None:
+                continue
+            ratio = result['seconds'] / stored['seconds']
+            if ratio > 1 + tolerance:
+                regressions.append({'name': name, 'seconds': result['seconds'], 'baseline': stored['seconds'], 'ratio': ratio})
+
+    return regressions
+
+"""
+    Run the benchmarks, write the JSON report and compare it against a baseline
+"""
+def main():
+    parser = argparse.ArgumentParser(description = 'Benchmarks of the plaintext and the encrypted ACO')
+    parser.add_argument('--output', default = 'results/benchmark.json', help = 'JSON report to write')
+    parser.add_argument('--baseline', help = 'Stored JSON report to compare against')
+    parser.add_argument('--tolerance', type = float, default = 0.1, help = 'Allowed relative slowdown')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'Timed runs of each kernel')
+    parser.add_argument('--micro-sizes', type = int, nargs = '+', default = [52, 200], help = 'Nodes of the kernel instances')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [200, 400, 800], help = 'Nodes of the random instances')
+    parser.add_argument('--iterations', type = int, default = 10, help = 'Iterations of each run')
+    parser.add_argument('--colony', type = int, default = 50, help = 'Ants in the colony')
+    parser.add_argument('--encrypted', action = 'store_true', help = 'Also time whole encrypted runs')
+    parser.add_argument('--workers', type = int, help = 'Worker processes of the encrypted runs')
+    parser.add_argument('--skip-macro', action = 'store_true', help = 'Only run the kernels')
+    args = parser.parse_args()
+
+    # Environment of the report, timings only compare on the same machine
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'arguments': vars(args),
+        },
+        'micro': {},
+        'macro': {},
+    }
+
+    for n in args.micro_sizes:
+        report['micro'].update(microBenchmarks(n, args.colony, args.repeat))
+    if not args.skip_macro:
+        report['macro'] = macroBenchmarks(args.sizes, args.iterations, args.colony, args.encrypted, args.workers)
+
+    # Save report
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent = 2)
+    for kind in ('micro', 'macro'):
+        for name, result in report[kind].items():
+            print('{:<40} {:>12.6f}s'.format(name, result['seconds']))
+    print('Report written to {}'.format(args.output))
+
+    # Compare, a regression fails the run
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION {name}: {seconds:.6f}s against {baseline:.6f}s ({ratio:.2f}x)'.format(**regression))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(args.baseline))
+
+if __name__ == '__main__':
+    main()
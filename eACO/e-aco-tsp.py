@@ -1,3 +1,4 @@
+from eACO.profiling import Profiler
 from eACO.stopwatch import Stopwatch
 from e_library import *
 import matplotlib.pyplot as plt
@@ -31,11 +32,13 @@ if __name__ == '__main__':
 
     sw = Stopwatch(3)
     sw.start()
-    # Run ACO
-    min_path, min_distance = runAcoTsp(space)
+    # Run ACO, timing every phase
+    profiler = Profiler()
+    min_path, min_distance = runAcoTsp(space, profiler=profiler)
     print(min_path.shape)
     sw.stop()
     print(sw)
+    print(profiler)
 
     # Plot path
     plt.scatter(space[:, 0], space[:, 1], marker='o', s=15)
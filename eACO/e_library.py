@@ -1,8 +1,19 @@
+import itertools
 import numpy as np
 import multiprocessing
 
+from eACO.preprocessing import Preprocessing
+from eACO.profiling import Profiler
+from eACO import protocol
+from eACO.protocol import fast_div, argmax, reveal
+from eACO.secret_matrix import SecretMatrix
+from eACO.shared import SharedArray
+from eACO.stopwatch import Stopwatch
+from eACO.transport import LoopbackTransport, Transport
 from eACO.utils import encrypt_2darray, get_fixed_point, decrypt_array, decrypt_2darray, get_fp, r_encrypt_2darray
-from ss.secret import Secret
+
+# Shared memory and parameters of a worker process, set by attach_shared
+worker_state = {}
 
 
 # [1] TSP
@@ -59,7 +70,8 @@ def displayTspHeaders(dict):
 
 
 # [2] ACO
-def runAcoTsp(space, iterations=80, colony=50, alpha=1.0, beta=1.0, del_tau=1, rho=0.5):
+def runAcoTsp(space, iterations=80, colony=50, alpha=1.0, beta=1.0, del_tau=1, rho=0.5, workers=None,
+              preprocessing=None, transport=None, profiler=None, chunk=None):
     """
         Run Ant Colony Optimization (ACO) algorithm for a given Symmetric traveling salesman problem (TSP) space and data
         @arg
@@ -70,74 +82,146 @@ def runAcoTsp(space, iterations=80, colony=50, alpha=1.0, beta=1.0, del_tau=1, r
             {float} beta {1.0}              -- Beta algorithm parameter, more or less weight to a selected distance
             {float} del_tau {1.0}           -- Delta Tau algorithm parameter, pheromones releasing rate
             {float} rho {0.5}               -- Rho algorithm parameter, pheromones evaporation rate
+            {int} workers {None}            -- Number of worker processes, the CPU count if None
+            {string} preprocessing {None}   -- Directory of an offline preprocessing pool, used up by the run,
+                                               online dealer if None
+            {Transport} transport {None}    -- Network between the two parties, collects the communication of every
+                                               process, in-process loopback if None
+            {Profiler} profiler {None}      -- Collects the time and calls of every phase of every process
+            {int} chunk {None}              -- Ants per task building whole tours against the pheromones of the
+                                               iteration, one task per step and group of ants if None
         @return
             {Tuple(numpy.ndarray, float)}   -- Indexes of the minimun distance path and the minimun distance
     """
+    # Phases timed even without a profiler to report to
+    profiler = profiler or Profiler()
     # 本地阶段
     # 只支持alpha和beta为1
     alpha = 1
     beta = 1
-    rho = Secret(int(1 / rho))
+    # Evaporation divides the pheromones by a public integer
+    rho = int(1 / rho)
     # Find encrypted inverted distances for all nodes
-    inv_distances, distances = inverseDistances(space)
-    # Add beta algorithm parameter to inverted distances
-    inv_distances = (inv_distances ** beta)
-    # Empty pheromones trail
-    pheromones = encrypt_2darray(np.zeros((space.shape[0], space.shape[0])))
+    inv_distances, distances = inverseDistances(space, profiler=profiler)
+    # Offline preprocessing pool must cover the whole run, and is used up by it
+    if preprocessing:
+        randomness = Preprocessing(preprocessing)
+        if not randomness.covers(space.shape[0], colony, iterations):
+            raise ValueError('Preprocessing pool {} is smaller than the run'.format(preprocessing))
+        randomness.consume()
     # 加密参数
     fp = 10 ** get_fixed_point()
-    del_tau = Secret(del_tau * fp)
+    with profiler.phase('encryption'):
+        del_tau = SecretMatrix.share(int(del_tau * fp))
     # 在线阶段
     # Empty minimum distance and path
     min_distance = None
     min_path = None
 
-    # [2] For the number of iterations
-    for i in range(iterations):
-        print('Iteration: ', i)
-        # Initial random positions
-        positions = initializeAnts(space.shape, colony)
-
-        # Complete a path
-        # [e]space, [p]positions, [e]inv_distances, [e]pheromones, [p]alpha, [p]beta, [e]del_tau
-        paths = moveAnts(space.shape, positions, inv_distances, pheromones, alpha, beta, del_tau)
-
-        # Evaporate pheromones
-        pheromones = pheromones / rho
-
-        # [3] For each path
-        for path in paths:
-            # Empty distance
-            distance = 0
-            # For each node from second to last
-            for node in range(1, path.shape[0]):
-                # Calculate distance to the last node
-                distance += distances[int(path[node]), int(path[node - 1])]
-            print(distance.recover())
+    # Network of the run, every worker counts on its own new one of the same kind and reports back
+    transport = transport or protocol.default_transport
+    previous_transport = protocol.use_transport(transport)
+
+    # Shared memory and worker processes, released even when the run fails
+    shared = {}
+    pool = None
+    try:
+        # Shares of the encrypted matrices and the public tour state, in shared memory
+        shared['inv_distances'] = SharedArray((2, space.shape[0], space.shape[0]), np.int64)
+        shared['pheromones'] = SharedArray((2, space.shape[0], space.shape[0]), np.int64)
+        shared['inv_distance_sums'] = SharedArray((2, space.shape[0]), np.int64)
+        shared['pheromone_sums'] = SharedArray((2, space.shape[0]), np.int64)
+        shared['paths'] = SharedArray((space.shape[0], colony), np.int64)
+        shared['visited'] = SharedArray((colony, space.shape[0]), bool)
+        with profiler.phase('encryption'):
+            # Inverted distances and empty pheromones trail, updated in place in the shared memory
+            shared['inv_distances'].array[:] = inv_distances.shares
+            inv_distances = SecretMatrix(shared['inv_distances'].array)
+            pheromones = SecretMatrix(shared['pheromones'].array)
+            pheromones[...] = encrypt_2darray(np.zeros((space.shape[0], space.shape[0])))
+            # Row sums, the probability denominators: fixed for the inverted distances, kept up to date for the pheromones
+            inv_distance_sums = SecretMatrix(shared['inv_distance_sums'].array)
+            inv_distance_sums[...] = inv_distances.sum(axis=1)
+            pheromone_sums = SecretMatrix(shared['pheromone_sums'].array)
+            pheromone_sums[...] = pheromones.sum(axis=1)
+
+        # Worker processes, alive for the whole run and attached to the shared memory
+        specs = {key: item.spec() for key, item in shared.items()}
+        pool = multiprocessing.Pool(workers, initializer=attach_shared, initargs=(specs, preprocessing, transport.spec()))
+
+        # [2] For the number of iterations
+        for i in range(iterations):
+            print('Iteration: ', i)
+            # Initial random positions
+            positions = initializeAnts(space.shape, colony)
+
+            # Complete a path
+            # [e]space, [p]positions, [e]inv_distances, [e]pheromones, [p]alpha, [p]beta, [e]del_tau
+            with profiler.phase('construction'):
+                paths = moveAnts(space.shape, positions, inv_distances, pheromones, alpha, beta, del_tau, pool, shared, i,
+                                 profiler, chunk)
+
+            # Evaporate pheromones, and their row sums (within the truncation error of one per node)
+            with profiler.phase('evaporation'):
+                pheromones[...] = pheromones.rescale(rho)
+                pheromone_sums[...] = pheromone_sums.rescale(rho)
+
+            # [3] Encrypted closed tour distance of every path at once, recovered for reporting
+            with profiler.phase('tour evaluation'):
+                e_tour_distances = distances[paths, np.roll(paths, -1, axis=1)].sum(axis=1)
+            with profiler.phase('recover'):
+                tour_distances = reveal(e_tour_distances)
+            print(tour_distances)
             # Update minimun distance and path if less nor non-existent
-            if not min_distance or distance < min_distance:
-                min_distance = distance
-                min_path = path
-                min_path = np.append(min_path, min_path[0])
-        print('Iteration: ', i, " ", min_distance.recover())
+            best = np.argmin(tour_distances)
+            if min_distance is None or tour_distances[best] < min_distance:
+                min_distance = tour_distances[best]
+                min_path = np.append(paths[best], paths[best][0])
+            print('Iteration: ', i, " ", min_distance)
+    finally:
+        # Release worker processes and shared memory
+        if pool:
+            pool.close()
+            pool.join()
+        for item in shared.values():
+            item.close(unlink=True)
+        protocol.use_transport(previous_transport)
     # Return tuple
-    return min_path, min_distance.recover()
+    return min_path, min_distance
 
 
-def inverseDistances(space):
+def inverseDistances(space, dtype=np.float64, chunk=None, profiler=None):
     """
         Inverse distance - Get an array of inverted distances
         @arg
-            {numpy.ndarray} space   -- The space
+            {numpy.ndarray} space       -- The space
+            {type} dtype {float64}      -- Floating-point type of the plaintext arrays, float32 halves the memory
+            {int} chunk {None}          -- Number of rows computed per block, all rows at once if None
+            {Profiler} profiler {None}  -- Collects the time of the plaintext computation and of the encryption
         @return
-            {numpy.ndarray}         -- A space.dimension per space.dimension array of inverse distances
+            {numpy.ndarray}             -- A space.dimension per space.dimension array of inverse distances
     """
+    # Plaintext computation timed apart from the encryption
+    profiler = profiler or Profiler()
+    stopwatch = Stopwatch()
+
+    # Coordinates in the requested precision
+    space = np.asarray(space, dtype=dtype)
+
+    # Rows computed per block, all of them at once by default
+    chunk = chunk or space.shape[0]
+
     # Empty multidimensional array (matriz) to distances
-    distances = np.zeros((space.shape[0], space.shape[0]))
+    distances = np.empty((space.shape[0], space.shape[0]), dtype=dtype)
 
-    # Calculate distance to all nodes to all nodes
-    for index, point in enumerate(space):
-        distances[index] = np.sqrt(((space - point) ** 2).sum(axis=1))
+    # Calculate distance to all nodes from a block of nodes, one coordinate at a time
+    for start in range(0, space.shape[0], chunk):
+        block = distances[start:start + chunk]
+        block[:] = 0
+        for axis in range(space.shape[1]):
+            delta = np.subtract.outer(space[start:start + chunk, axis], space[:, axis])
+            block += np.square(delta, out=delta)
+        np.sqrt(block, out=block)
 
     # Floating-point error handling - Setted to known state
     with np.errstate(all='ignore'):
@@ -147,8 +231,12 @@ def inverseDistances(space):
     # Replace infinity by zero to prevent zero division error
     inv_distances[inv_distances == np.inf] = 0
 
+    # Plaintext distances done
+    profiler.record('distance precompute', stopwatch.duration)
+
     # Eta algorithm result, inverted distances
-    return encrypt_2darray(inv_distances), r_encrypt_2darray(distances)
+    with profiler.phase('encryption'):
+        return encrypt_2darray(inv_distances), r_encrypt_2darray(distances)
 
 
 def initializeAnts(space_shape, colony):
@@ -164,7 +252,8 @@ def initializeAnts(space_shape, colony):
     return np.random.randint(space_shape[0], size=colony)
 
 
-def moveAnts(space_shape, positions, inv_distances, pheromones, alpha, beta, del_tau):
+def moveAnts(space_shape, positions, inv_distances, pheromones, alpha, beta, del_tau, pool, shared, iteration=0,
+             profiler=None, chunk=None):
     """
         Move ants - Move ants from initial positions to cover all nodes
         @arg
@@ -175,58 +264,160 @@ def moveAnts(space_shape, positions, inv_distances, pheromones, alpha, beta, del
             {float} alpha                   -- Alpha algorithm parameter, more or less weight to a selected distance
             {float} beta                    -- Beta algorithm parameter, more or less weight to a selected distance
             {float} del_tau                 -- Delta Tau algorithm parameter, pheromones releasing rate
+            {multiprocessing.Pool} pool     -- Worker processes moving the ants
+            {dict} shared                   -- Shared memory attached by the workers
+            {int} iteration {0}             -- Iteration number, selects the preprocessing slots
+            {Profiler} profiler {None}      -- Collects the time of the deposits and of the workers' phases
+            {int} chunk {None}              -- Ants per task building whole tours, one task per step and group of
+                                               ants if None
         @return
             {numpy.ndarry}                  -- Indexes of the paths taken by the ants
     """
-    # Empty multidimensional array (matriz) to paths
-    paths = np.zeros((space_shape[0], positions.shape[0]), dtype=int) - 1
+    # Empty multidimensional array (matriz) to paths, in shared memory
+    paths = shared['paths'].array
+    paths[:] = -1
 
     # Initial position at node zero
     paths[0] = positions
 
+    # Visited nodes bitmap, one row per ant, in shared memory
+    visited = shared['visited'].array
+    visited[:] = False
+    visited[np.arange(positions.shape[0]), positions] = True
+
+    profiler = profiler or Profiler()
+
+    # Row sums of the pheromones, updated along with the deposits
+    pheromone_sums = SecretMatrix(shared['pheromone_sums'].array)
+
+    # Whole tours for each chunk of ants against the pheromones of this iteration, no barrier between the steps
+    if chunk:
+        chunks = [range(start, min(start + chunk, positions.shape[0])) for start in range(0, positions.shape[0], chunk)]
+        results = pool.starmap(ants_tour, [(ants, iteration) for ants in chunks])
+        for _, stats, phases in results:
+            protocol.default_transport.merge(stats)
+            profiler.merge(phases)
+        # Deposits of all the tours merged in one reduction
+        with profiler.phase('deposit'):
+            rows, columns, amounts = (np.concatenate(parts, axis=-1) for parts in zip(*(res for res, _, _ in results)))
+            pheromones.add_at((rows, columns), SecretMatrix(amounts))
+            pheromone_sums.add_at(rows, SecretMatrix(amounts))
+        return np.swapaxes(paths, 0, 1).copy()
+
     # For nodes after start to end
     for node in range(1, space_shape[0]):
-        pool = multiprocessing.Pool(8)
-        queue = multiprocessing.Manager().Queue()
-        # For each ant
-        for ant in range(positions.shape[0]):
-            pool.apply_async(ant_move, (alpha, ant, beta, inv_distances, node, paths, pheromones, positions, queue))
-        pool.close()
-        pool.join()
-        while not queue.empty():
-            res = queue.get()
-            paths[res[0], res[1]] = res[2]
-            pheromones[res[0], res[2]] += res[3]
-    # Paths taken by the ants
-    return np.swapaxes(paths, 0, 1)
-
-
-def ant_move(alpha, ant, beta, inv_distances, node, paths, pheromones, positions, queue):
-    # Probability to travel the nodes
-    # next_location_probability0 = ((inv_distances[positions[ant]] ** alpha + pheromones[positions[ant]] ** beta) * get_fp())/(inv_distances[positions[ant]].sum() ** alpha + pheromones[positions[ant]].sum() ** beta)
-    next_location_probability = inv_distances[positions[ant]] ** alpha + pheromones[positions[ant]] ** beta
-    for i in range(next_location_probability.shape[0]):
-        next_location_probability[i] *= get_fp()
-    temp1 = Secret(0)
-    for item in inv_distances[positions[ant]]:
-        temp1 += item ** alpha
-    temp2 = Secret(0)
-    for item in pheromones[positions[ant]]:
-        temp2 += item ** beta
-    temp1 += temp2
-    for i in range(next_location_probability.shape[0]):
-        next_location_probability[i] = next_location_probability[i].fast_div(temp1)[0]
-
-    # Index to maximum probability node
-    next_position = np.argmax(next_location_probability)
-    # Check if node has already been visited
-    while next_position in paths[:, ant]:
-        # Replace the probability of visited to zero
-        next_location_probability[next_position] = Secret(0)
-        # Find the maximum probability node
-        next_position = np.argmax(next_location_probability)
-    # # Add node to path
-    # paths[node, ant] = next_position
-    # # Update pheromones (releasing pheromones)
-    # pheromones[node, next_position] += del_tau
-    queue.put([node, ant, next_position, inv_distances[positions[ant], node]])
+        # Ants standing on the same node share its probability row, computed once in this step
+        groups = {}
+        for ant, position in enumerate(paths[node - 1]):
+            groups.setdefault(position, []).append(ant)
+        # For each group of ants, moving from their current node
+        results = pool.starmap(ants_move, [(ants, node, iteration) for ants in groups.values()])
+        for _, stats, phases in results:
+            protocol.default_transport.merge(stats)
+            profiler.merge(phases)
+        with profiler.phase('deposit'):
+            for res in itertools.chain.from_iterable(moves for moves, _, _ in results):
+                paths[res[0], res[1]] = res[2]
+                visited[res[1], res[2]] = True
+                pheromones[res[0], res[2]] += res[3]
+                pheromone_sums[res[0]] += res[3]
+    # Paths taken by the ants, copied out of the reused shared memory
+    return np.swapaxes(paths, 0, 1).copy()
+
+
+def attach_shared(specs, preprocessing=None, transport=None):
+    """
+        Attach a worker process to the shared memory, used as the pool initializer
+        @arg
+            {dict} specs                    -- Shared memory descriptions by name
+            {string} preprocessing {None}   -- Directory of an offline preprocessing pool
+            {tuple} transport {None}        -- Description of the network between the two parties, built anew for
+                                               this process, in-process loopback if None
+    """
+    # Fresh randomness for the dealer of every worker, forked workers would otherwise repeat the parent's stream
+    np.random.seed()
+    worker_state.update({key: SharedArray.attach(spec) for key, spec in specs.items()})
+    worker_state['preprocessing'] = Preprocessing(preprocessing) if preprocessing else None
+    worker_state['profiler'] = Profiler()
+    # Own network with empty statistics, forked workers would otherwise share the parent's sockets and counts
+    protocol.use_transport(Transport.create(transport) if transport else LoopbackTransport())
+
+
+def ants_move(ants, node, iteration):
+    # Public tour state shared with the main process, all the ants stand on the same node
+    position = worker_state['paths'].array[node - 1, ants[0]]
+    # Correlated randomness of each move, from the offline pool if there is one
+    preprocessing = worker_state['preprocessing']
+    dealers = [preprocessing and preprocessing.slot(iteration, ant, node) for ant in ants]
+    # Encrypted row of the current node, read from the shared shares
+    inv_distances = SecretMatrix(worker_state['inv_distances'].array)[position]
+
+    # Probability row of the current node, from the randomness of the first ant of the group
+    profiler = worker_state['profiler']
+    with profiler.phase('division'):
+        next_location_probability = probabilityRow(position, dealers[0])
+
+    results = []
+    for ant, dealer in zip(ants, dealers):
+        # Index to maximum probability node, skipping the nodes already visited by the ant
+        with profiler.phase('argmax'):
+            next_position = argmax(next_location_probability, worker_state['visited'].array[ant], dealer)
+        # # Add node to path
+        # paths[node, ant] = next_position
+        # # Update pheromones (releasing pheromones)
+        # pheromones[node, next_position] += del_tau
+        results.append([node, ant, next_position, inv_distances[node]])
+    # Moves, and the communication and time they took
+    return results, protocol.default_transport.pop_stats(), profiler.pop_stats()
+
+
+def ants_tour(ants, iteration):
+    # Public paths shared with the main process, each task writes the columns of its own ants
+    paths = worker_state['paths'].array
+    preprocessing = worker_state['preprocessing']
+    profiler = worker_state['profiler']
+    inv_distances = SecretMatrix(worker_state['inv_distances'].array)
+
+    # Probability rows by node, valid for the whole task since the pheromones only change after the iteration
+    rows = {}
+    deposits = []
+    for ant in ants:
+        # Visited nodes of this ant only
+        visited = np.zeros(paths.shape[0], dtype=bool)
+        visited[paths[0, ant]] = True
+        for node in range(1, paths.shape[0]):
+            position = paths[node - 1, ant]
+            # Correlated randomness of this move, from the offline pool if there is one
+            dealer = preprocessing and preprocessing.slot(iteration, ant, node)
+            if position not in rows:
+                with profiler.phase('division'):
+                    rows[position] = probabilityRow(position, dealer)
+            # Index to maximum probability node, skipping the nodes already visited by the ant
+            with profiler.phase('argmax'):
+                next_position = argmax(rows[position], visited, dealer)
+            paths[node, ant] = next_position
+            visited[next_position] = True
+            deposits.append((node, next_position, inv_distances[position, node].shares))
+
+    # Deposits as index arrays and stacked shares, the communication and time they took
+    rows, columns, amounts = zip(*deposits)
+    return (np.array(rows), np.array(columns), np.stack(amounts, axis=-1)), \
+        protocol.default_transport.pop_stats(), profiler.pop_stats()
+
+
+def probabilityRow(position, dealer=None):
+    """
+        Probability row - Encrypted probability to travel from a node to every node, before the visited masking
+        @arg
+            {int} position                  -- Index of the current node
+            {Dealer} dealer {None}          -- Source of correlated randomness, the online dealer if None
+        @return
+            {SecretMatrix}                  -- Encrypted probabilities of the row, scaled by the fixed point
+    """
+    # Encrypted rows of the current node, read from the shared shares
+    inv_distances = SecretMatrix(worker_state['inv_distances'].array)[position]
+    pheromones = SecretMatrix(worker_state['pheromones'].array)[position]
+
+    # Probability to travel the nodes (alpha and beta are 1), the whole row divided by its cached total at once
+    temp1 = SecretMatrix(worker_state['inv_distance_sums'].array)[position] + SecretMatrix(worker_state['pheromone_sums'].array)[position]
+    return fast_div((inv_distances + pheromones) * get_fp(), temp1, dealer)
@@ -1,16 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor
+
 from eACO.utils import saveSpacePlot, savePathPlot, saveResultsTxt, msg
 from e_library import *
 
 
-def test(tsp):
+def test(tsp, processes=None, seed=None, workers=None):
     """
         Run Ant Colony Optimization (ACO) algorithm for a given Symmetric traveling salesman problem (TSP)
         @arg
-            {string} tsp    -- The TSP file src name (located in /data folder)
+            {string} tsp            -- The TSP file src name (located in /data folder)
+            {int} processes {None}  -- Number of processes running the repetitions, the CPU count if None
+            {int} seed {None}       -- Seed of the repetitions, fresh entropy if None
+            {int} workers {None}    -- Number of worker processes of each repetition, the CPU count if None
+
+        @export
+            {results}               -- Generated files for results
+            {plots}                 -- Generated files for plots
+    """
+    test_all([tsp], processes, seed, workers)
+
+
+def test_all(tsps, processes=None, seed=None, workers=None):
+    """
+        Run Ant Colony Optimization (ACO) algorithm for several Symmetric traveling salesman problems (TSP), every
+        repetition of every problem as an independent job of a process pool
+        @arg
+            {list} tsps             -- The TSP file src names (located in /data folder)
+            {int} processes {None}  -- Number of processes running the jobs, the CPU count if None
+            {int} seed {None}       -- Seed of the jobs, fresh entropy if None
+            {int} workers {None}    -- Number of worker processes of each job, the CPU count if None
 
         @export
-            {results}       -- Generated files for results
-            {plots}         -- Generated files for plots
+            {results}               -- Generated files for results, once all the jobs are done
+            {plots}                 -- Generated files for plots, once all the jobs are done
     """
     # Default arguments
     '''
@@ -32,41 +54,56 @@ def test(tsp):
     beta = 1
     del_tau = 1.0
     rho = 0.5
-
-    results = np.zeros(n)   # Store
+    parameters = (iterations, colony, alpha, beta, del_tau, rho, workers)
 
     # Get TSP data
-    src = getTspData('../data/{}.tsp'.format(tsp))
-    space = None
-    space = np.array(src['node_coord_section'])
+    sources = {tsp: getTspData('../data/{}.tsp'.format(tsp)) for tsp in tsps}
+    spaces = {tsp: np.array(src['node_coord_section']) for tsp, src in sources.items()}
 
-    # Inform
-    msg('Computing {} times for {}'.format(n, tsp))
+    # Independent random stream of every (instance, repetition) job
+    jobs = [(tsp, i) for tsp in tsps for i in range(n)]
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(jobs))]
 
-    # Save space plot
-    saveSpacePlot(tsp, space)
+    # Inform
+    msg('Computing {} times for {} in {} jobs'.format(n, ', '.join(tsps), len(jobs)))
 
-    # Repeat and save path plot for each result
-    for i in range(n):
-        # Run
-        min_path, min_distance = runAcoTsp(space, iterations, colony, alpha, beta, del_tau, rho)
+    # Run every job in the pool, whose processes may start the worker processes of each run
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(run_job, spaces[tsp], parameters, job_seed) for (tsp, i), job_seed in zip(jobs, seeds)]
+        outcomes = [future.result() for future in futures]
 
-        # Store result
-        results[i] = min_distance
+    # Save plots and results once every job is done
+    for tsp in tsps:
+        results = np.zeros(n)   # Store
+        saveSpacePlot(tsp, spaces[tsp])
+        for (job_tsp, i), (min_path, min_distance) in zip(jobs, outcomes):
+            if job_tsp == tsp:
+                results[i] = min_distance
+                savePathPlot(i, n, tsp, spaces[tsp], min_path, min_distance)
+        saveResultsTxt(sources[tsp], results, iterations, colony, alpha, beta, del_tau, rho)
 
-        # Save path plot
-        savePathPlot(i, n, tsp, space, min_path, min_distance)
 
-    # Save results txt
-    saveResultsTxt(src, results, iterations, colony, alpha, beta, del_tau, rho)
+def run_job(space, parameters, seed):
+    """
+        Run a single repetition, the job of a pool process
+        @arg
+            {numpy.ndarray} space   -- The space
+            {tuple} parameters      -- Positional parameters of runAcoTsp after the space
+            {int} seed              -- Seed of the random stream of the job
 
+        @return
+            {Tuple(numpy.ndarray, float)}   -- Indexes of the minimun distance path and the minimun distance
+    """
+    # Random stream of this job only
+    np.random.seed(seed)
 
+    # Run
+    return runAcoTsp(space, *parameters)
 
 
 def main():
-    # Test for each stored TSP data
-    test('kroA100')
-    test('berlin52')
+    # Test for each stored TSP data, all the repetitions in parallel
+    test_all(['kroA100', 'berlin52'])
 
     # Inform
     msg('All files generated, see /results for details')
@@ -0,0 +1,126 @@
+import os
+import sys
+
+import numpy as np
+
+from eACO.protocol import mask_bits, truncation_bits
+from eACO.secret_matrix import SecretMatrix, int64
+
+# Files of a preprocessing pool directory, and the marker left by the run that used it
+files = ('triples', 'masks', 'truncation')
+consumed = 'consumed'
+
+
+def slot_sizes(n):
+    """
+    每只蚂蚁每一步最多消耗的相关随机数：三元组元素、乘性掩码、截断掩码
+    fast_div 用 n + 1 个三元组元素、1 个乘性掩码、n 个截断掩码；argmax 最多 n - 1 次比较，每次 1 个三元组元素和 1 个乘性掩码
+    """
+    return 2 * n, n, n
+
+
+class Preprocessing:
+    """
+    离线预处理的相关随机数池，保存为内存映射的.npy文件
+    按 (迭代, 蚂蚁, 步) 划分固定的格子，多个进程不需协调即可并行消耗
+    每个池只能用于一次运行，重复使用相关随机数会泄露被掩盖的值
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.triples, self.masks, self.truncation = (
+            np.load(os.path.join(path, name + '.npy'), mmap_mode=mode) for name in files
+        )
+
+    @classmethod
+    def generate(cls, path, n, colony, iterations):
+        """
+        为 n 个节点、colony 只蚂蚁、iterations 次迭代生成随机数池，逐次迭代写入磁盘
+        """
+        os.makedirs(path, exist_ok=True)
+        triple_size, mask_size, truncation_size = slot_sizes(n)
+        slots = (iterations, colony, n - 1)
+        triples = np.lib.format.open_memmap(os.path.join(path, 'triples.npy'), mode='w+', dtype=np.int64,
+                                            shape=slots + (3, 2, triple_size))
+        masks = np.lib.format.open_memmap(os.path.join(path, 'masks.npy'), mode='w+', dtype=np.int64,
+                                          shape=slots + (2, mask_size))
+        truncation = np.lib.format.open_memmap(os.path.join(path, 'truncation.npy'), mode='w+', dtype=np.int64,
+                                               shape=slots + (2, truncation_size))
+
+        # One iteration at a time, with the party axis moved behind the slot axes
+        for i in range(iterations):
+            a = np.random.randint(int64.min, int64.max, size=slots[1:] + (triple_size,), dtype=np.int64)
+            b = np.random.randint(int64.min, int64.max, size=a.shape, dtype=np.int64)
+            for index, value in enumerate((a, b, np.multiply(a, b))):
+                triples[i, :, :, index] = np.moveaxis(SecretMatrix.share(value).shares, 0, -2)
+            r = np.random.randint(1, 2 ** mask_bits, size=slots[1:] + (mask_size,), dtype=np.int64)
+            masks[i] = np.moveaxis(SecretMatrix.share(r).shares, 0, -2)
+            truncation[i] = np.random.randint(0, 2 ** truncation_bits, size=truncation.shape[1:], dtype=np.int64)
+
+        for array in (triples, masks, truncation):
+            array.flush()
+        # Only once all the randomness is new can the pool be used again
+        if os.path.exists(os.path.join(path, consumed)):
+            os.remove(os.path.join(path, consumed))
+        return cls(path)
+
+    def covers(self, n, colony, iterations):
+        """
+        随机数池是否足够 n 个节点、colony 只蚂蚁、iterations 次迭代使用
+        """
+        return self.masks.shape[0] >= iterations and self.masks.shape[1] >= colony and self.masks.shape[2] == n - 1
+
+    def consume(self):
+        """
+        在目录中标记随机数池已被使用，已用过的池报错
+        """
+        try:
+            open(os.path.join(self.path, consumed), 'x').close()
+        except FileExistsError:
+            raise ValueError('Preprocessing pool {} has already been used'.format(self.path)) from None
+
+    def slot(self, iteration, ant, step):
+        """
+        第iteration次迭代中第ant只蚂蚁第step步（从1开始）的随机数格子
+        """
+        index = (iteration, ant, step - 1)
+        return SlotDealer(self.triples[index], self.masks[index], self.truncation[index])
+
+
+class SlotDealer:
+    """
+    依次取出一个格子中的相关随机数，接口与protocol.Dealer相同
+    """
+
+    def __init__(self, triples, masks, truncation):
+        self.triples = triples
+        self.masks = masks
+        self.truncation = truncation
+        self.used = {'triples': 0, 'masks': 0, 'truncation': 0}
+
+    def take(self, name, shape):
+        """
+        取出给定形状的下一段分享，格子用完时报错
+        """
+        pool = getattr(self, name)
+        size = int(np.prod(shape, dtype=np.int64))
+        start = self.used[name]
+        if start + size > pool.shape[-1]:
+            raise ValueError('Preprocessing slot exhausted: {} needs {} more than {}'.format(name, size, pool.shape[-1] - start))
+        self.used[name] = start + size
+        return np.array(pool[..., start:start + size]).reshape(pool.shape[:-1] + tuple(shape))
+
+    def triple(self, shape):
+        return tuple(SecretMatrix(shares) for shares in self.take('triples', shape))
+
+    def mask(self, shape):
+        return SecretMatrix(self.take('masks', shape))
+
+    def truncation_mask(self, shape):
+        return SecretMatrix(self.take('truncation', shape))
+
+
+if __name__ == '__main__':
+    # python preprocessing.py <path> <n> <colony> <iterations>
+    path, n, colony, iterations = sys.argv[1], *map(int, sys.argv[2:5])
+    Preprocessing.generate(path, n, colony, iterations)
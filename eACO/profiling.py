@@ -0,0 +1,71 @@
+import contextlib
+import json
+
+from eACO.stopwatch import Stopwatch
+
+
+class Profiler:
+    """
+    按阶段累计耗时和调用次数，每段用一个Stopwatch计时
+    callback在每次记录后收到事件字典，sink为JSON lines文件的路径或可写的文件对象
+    """
+
+    def __init__(self, callback=None, sink=None):
+        self.callback = callback
+        self.owns_sink = isinstance(sink, str)
+        self.sink = open(sink, 'a') if self.owns_sink else sink
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        给with语句块计时，记在阶段name上
+        """
+        stopwatch = Stopwatch()
+        try:
+            yield
+        finally:
+            stopwatch.stop()
+            self.record(name, stopwatch.duration)
+
+    def record(self, name, seconds, calls=1):
+        entry = self.phases.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        entry['calls'] += calls
+        entry['seconds'] += seconds
+        if self.callback or self.sink:
+            event = {'phase': name, 'seconds': seconds, 'calls': calls,
+                     'total_seconds': entry['seconds'], 'total_calls': entry['calls']}
+            if self.callback:
+                self.callback(event)
+            if self.sink:
+                self.sink.write(json.dumps(event) + '\n')
+
+    def merge(self, phases):
+        """
+        合并其他进程的统计
+        """
+        for name, entry in phases.items():
+            self.record(name, entry['seconds'], entry['calls'])
+
+    def pop_stats(self):
+        """
+        取出并清空统计
+        """
+        phases, self.phases = self.phases, {}
+        return phases
+
+    def close(self):
+        """
+        写完JSON lines文件，按路径打开的文件随之关闭
+        """
+        if self.sink:
+            self.sink.flush()
+            if self.owns_sink:
+                self.sink.close()
+
+    def __str__(self) -> str:
+        width = max([len(name) for name in self.phases] + [5])
+        lines = ['{:<{}} {:>8} {:>12}'.format('phase', width, 'calls', 'seconds')]
+        for name, entry in self.phases.items():
+            lines.append('{:<{}} {:>8} {:>12.3f}'.format(name, width, entry['calls'], entry['seconds']))
+        return '\n'.join(lines)
@@ -0,0 +1,146 @@
+import functools
+
+import numpy as np
+
+from eACO.secret_matrix import SecretMatrix, int64
+from eACO.transport import LoopbackTransport
+
+# Bits of the random multiplicative masks used by fast_div, small enough to keep the masked values inside int64
+mask_bits = 16
+# Bits of each share of the truncation masks, divided values must stay below 2^truncation_bits
+truncation_bits = 61
+
+
+class Dealer:
+    """
+    可信第三方，在线按需生成相关随机数：乘法三元组和乘性掩码
+    """
+
+    def triple(self, shape):
+        """
+        逐元素的乘法三元组 [a], [b], [c]，c = a * b
+        """
+        a = np.random.randint(int64.min, int64.max, size=shape, dtype=np.int64)
+        b = np.random.randint(int64.min, int64.max, size=shape, dtype=np.int64)
+        return SecretMatrix.share(a), SecretMatrix.share(b), SecretMatrix.share(np.multiply(a, b))
+
+    def mask(self, shape):
+        """
+        正的随机乘性掩码 [r]，1 <= r < 2^mask_bits
+        """
+        return SecretMatrix.share(np.random.randint(1, 2 ** mask_bits, size=shape, dtype=np.int64))
+
+    def truncation_mask(self, shape):
+        """
+        非负的截断掩码 [R]，两方的分享都在 [0, 2^truncation_bits) 内，相加不会回绕
+        """
+        return SecretMatrix(np.random.randint(0, 2 ** truncation_bits, size=(2,) + tuple(shape), dtype=np.int64))
+
+
+# Dealer used by the protocol when no other source of correlated randomness is given
+default_dealer = Dealer()
+# Network between the two parties, every reveal goes through it
+default_transport = LoopbackTransport()
+
+
+def use_transport(transport):
+    """
+    替换两方之间的网络，返回原来的网络
+    """
+    global default_transport
+    previous, default_transport = default_transport, transport
+    return previous
+
+
+def primitive(name):
+    """
+    把函数内的通信记在名为name的原语上
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with default_transport.primitive(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reveal(x: SecretMatrix):
+    """
+    两方交换分享，公开明文（第一方重构的结果）
+    """
+    received = default_transport.exchange(x.shares)
+    return np.add(x.shares[0], received[0])
+
+
+@primitive('mul')
+def multiply(x: SecretMatrix, y: SecretMatrix, dealer=None):
+    """
+    Beaver乘法，[x * y]（按numpy规则广播），一轮通信
+    """
+    shape = np.broadcast_shapes(x.shape, y.shape)
+    x = x.broadcast_to(shape)
+    y = y.broadcast_to(shape)
+    a, b, c = (dealer or default_dealer).triple(shape)
+    # x - a and y - b opened together in one round
+    e, f = reveal(SecretMatrix(np.stack(((x - a).shares, (y - b).shares), axis=1)))
+    return c + b * e + a * f + np.multiply(e, f)
+
+
+@primitive('divide')
+def divide_public(x: SecretMatrix, divisor: int, dealer=None):
+    """
+    按公开整数截断除法，[x // divisor]，误差不超过2
+    公开 x + R 后各自减去自己那部分掩码的商，避免本地截断在分享回绕时的大误差，要求 |x| < 2^truncation_bits
+    """
+    mask = (dealer or default_dealer).truncation_mask(x.shape)
+    z = reveal(x + mask)
+    shares = np.negative(np.floor_divide(mask.shares, divisor))
+    shares[0] = np.add(shares[0], np.floor_divide(z, divisor))
+    return SecretMatrix(shares)
+
+
+@primitive('fast_div')
+def fast_div(numerators: SecretMatrix, denominator: SecretMatrix, dealer=None):
+    """
+    批量安全除法，整组分子除以同一个分母，[x / d]
+    分子和分母乘上同一个随机掩码r，一次乘法得到[x r]和[d r]，公开d r后按公开整数除法
+    d r 按乘性掩码泄露d的数量级；整行只需一次乘法、两次公开
+    """
+    # Numerators and denominator masked together in a single multiplication
+    r = (dealer or default_dealer).mask(())
+    masked = multiply(SecretMatrix(np.concatenate((numerators.shares, denominator.shares[:, None]), axis=1)), r, dealer)
+
+    # Public masked denominator
+    divisor = int(reveal(masked[-1]))
+    if divisor <= 0:
+        return SecretMatrix.zeros(numerators.shape)
+    return divide_public(masked[:-1], divisor, dealer)
+
+
+@primitive('compare')
+def compare(x: SecretMatrix, y: SecretMatrix, dealer=None):
+    """
+    批量安全比较，公开 x >= y
+    [x - y] 乘上正的随机掩码后公开，只泄露符号（以及掩码下的数量级），一次乘法
+    """
+    difference = x - y
+    return reveal(multiply(difference, (dealer or default_dealer).mask(difference.shape), dealer)) >= 0
+
+
+def argmax(values: SecretMatrix, visited=None, dealer=None):
+    """
+    锦标赛安全argmax，每层一次批量比较，共 ceil(log2 n) 层
+    公开的visited掩码中的节点一开始就被排除，不需要重试
+    """
+    # Candidates, without the visited ones
+    index = np.arange(values.shape[0]) if visited is None else np.flatnonzero(~visited)
+
+    # Each level compares disjoint pairs in one batch, an odd candidate goes up unopposed
+    while index.shape[0] > 1:
+        pairs = index.shape[0] // 2
+        left = index[0:2 * pairs:2]
+        right = index[1:2 * pairs:2]
+        winners = np.where(compare(values[left], values[right], dealer), left, right)
+        index = np.concatenate((winners, index[2 * pairs:]))
+    return index[0]
@@ -0,0 +1,124 @@
+import numpy as np
+
+# Two parties, each holding one int64 share of every element
+parties = 2
+int64 = np.iinfo(np.int64)
+
+
+class SecretMatrix:
+    """
+    两方加法秘密分享的整数矩阵
+    每一方的分享是一个连续的int64数组，shares[0] + shares[1] 在2^64环上等于明文
+    """
+
+    def __init__(self, shares: np.array):
+        self.shares = shares
+
+    @classmethod
+    def share(cls, ndarray: np.array):
+        """
+        分享整数数组，一次生成全部随机分享
+        """
+        values = np.asarray(ndarray, dtype=np.int64)
+        shares = np.empty((parties,) + values.shape, dtype=np.int64)
+        shares[1] = np.random.randint(int64.min, int64.max, size=values.shape, dtype=np.int64)
+        shares[0] = np.subtract(values, shares[1])
+        return cls(shares)
+
+    @classmethod
+    def zeros(cls, shape):
+        """
+        全零矩阵的平凡分享
+        """
+        return cls(np.zeros((parties,) + tuple(shape), dtype=np.int64))
+
+    @property
+    def shape(self):
+        return self.shares.shape[1:]
+
+    def recover(self) -> np.array:
+        """
+        恢复明文整数数组
+        """
+        return np.add(self.shares[0], self.shares[1])
+
+    def copy(self):
+        return SecretMatrix(self.shares.copy())
+
+    def sum(self, axis=None):
+        """
+        本地求和，每一方对自己的分享求和
+        """
+        if axis is None:
+            axis = tuple(range(1, self.shares.ndim))
+        elif axis >= 0:
+            axis += 1
+        return SecretMatrix(self.shares.sum(axis=axis))
+
+    def broadcast_to(self, shape):
+        """
+        按numpy规则广播到给定形状
+        """
+        shape = tuple(shape)
+        return SecretMatrix(np.broadcast_to(_align(self.shares, len(shape)), (parties,) + shape))
+
+    def rescale(self, divisor: int):
+        """
+        定点数缩放，按公开整数截断除法
+        两方分别向下、向上取整，结果与明文相差不超过1（分享回绕时除外，概率约为|x|/2^63）
+        """
+        shares = np.empty_like(self.shares)
+        shares[0] = np.floor_divide(self.shares[0], divisor)
+        shares[1] = np.negative(np.floor_divide(np.negative(self.shares[1]), divisor))
+        return SecretMatrix(shares)
+
+    def add_at(self, key, values):
+        """
+        按下标累加（重复下标都会累加），np.add.at作用在每一方的分享上
+        """
+        np.add.at(self.shares, self._index(key), values.shares)
+
+    def __getitem__(self, key):
+        return SecretMatrix(self.shares[self._index(key)])
+
+    def __setitem__(self, key, value):
+        self.shares[self._index(key)] = value.shares
+
+    def __add__(self, other):
+        if isinstance(other, SecretMatrix):
+            ndim = max(len(self.shape), len(other.shape))
+            return SecretMatrix(np.add(_align(self.shares, ndim), _align(other.shares, ndim)))
+        # Public values are added by the first party only
+        other = np.asarray(other, dtype=np.int64)
+        shape = np.broadcast_shapes(self.shape, other.shape)
+        shares = np.broadcast_to(_align(self.shares, len(shape)), (parties,) + shape).copy()
+        shares[0] = np.add(shares[0], other)
+        return SecretMatrix(shares)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return SecretMatrix(np.negative(self.shares))
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, other):
+        # Only public integers, secret products need the multiplication protocol
+        other = np.asarray(other, dtype=np.int64)
+        return SecretMatrix(np.multiply(_align(self.shares, max(len(self.shape), other.ndim)), other))
+
+    __rmul__ = __mul__
+
+    @staticmethod
+    def _index(key):
+        # Same index on every party's share
+        return (slice(None),) + (key if isinstance(key, tuple) else (key,))
+
+
+def _align(shares, ndim):
+    # Pad the value axes so that numpy broadcasts values against values, never against the party axis
+    return shares.reshape((shares.shape[0],) + (1,) * (ndim + 1 - shares.ndim) + shares.shape[1:])
@@ -0,0 +1,40 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+
+class SharedArray:
+    """
+    共享内存中的numpy数组，子进程按名字零拷贝挂载
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        按spec()的描述挂载已有的共享内存
+        """
+        name, shape, dtype = spec
+        return cls(shape, dtype, name)
+
+    def spec(self):
+        """
+        挂载所需的描述：名字、形状、类型
+        """
+        return self.memory.name, self.shape, self.dtype.str
+
+    def close(self, unlink=False):
+        """
+        释放共享内存，创建者负责unlink
+        """
+        del self.array
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
@@ -0,0 +1,139 @@
+import contextlib
+import socket
+import threading
+import time
+
+import numpy as np
+
+
+class Transport:
+    """
+    两方之间的网络，每次公开是一轮通信：两方同时把自己的分享发给对方
+    按原语统计调用次数、轮数、消息数、字节数和注入的延迟，latency为每轮的秒数，bandwidth为每秒字节数
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = {}
+        self.primitives = []
+
+    def __reduce__(self):
+        # Pickled copies are fresh transports of the same kind, with empty statistics
+        return self.spec()
+
+    def spec(self):
+        """
+        在其他进程中新建同类网络所需的描述：类型和参数，fork出的进程不能共用父进程的网络
+        """
+        return type(self), (self.latency, self.bandwidth)
+
+    @staticmethod
+    def create(spec):
+        """
+        按spec()的描述新建网络，统计为空
+        """
+        kind, args = spec
+        return kind(*args)
+
+    @contextlib.contextmanager
+    def primitive(self, name):
+        """
+        在原语内部的通信都记在最外层的原语上，例如fast_div里的乘法
+        """
+        if not self.primitives:
+            self.record(name, calls=1)
+        self.primitives.append(name)
+        try:
+            yield
+        finally:
+            self.primitives.pop()
+
+    def exchange(self, shares: np.array) -> np.array:
+        """
+        一轮通信，返回每一方收到的对方分享
+        """
+        shares = np.ascontiguousarray(shares)
+        received = self.send(shares)
+
+        # Both directions at once, the round costs the latency and one share over the bandwidth
+        delay = self.latency + (shares[0].nbytes / self.bandwidth if self.bandwidth else 0)
+        if delay:
+            time.sleep(delay)
+        name = self.primitives[0] if self.primitives else 'recover'
+        self.record(name, calls=0 if self.primitives else 1, rounds=1, messages=2, bytes=shares.nbytes, delay=delay)
+        return received
+
+    def send(self, shares: np.array) -> np.array:
+        raise NotImplementedError
+
+    def record(self, name, **counts):
+        entry = self.stats.setdefault(name, {'calls': 0, 'rounds': 0, 'messages': 0, 'bytes': 0, 'delay': 0.0})
+        for key, value in counts.items():
+            entry[key] += value
+
+    def merge(self, stats):
+        """
+        合并其他进程的统计
+        """
+        for name, counts in stats.items():
+            self.record(name, **counts)
+
+    def pop_stats(self):
+        """
+        取出并清空统计
+        """
+        stats, self.stats = self.stats, {}
+        return stats
+
+    def close(self):
+        pass
+
+
+class LoopbackTransport(Transport):
+    """
+    进程内的回环网络，两方的分享直接交换
+    """
+
+    def send(self, shares):
+        return shares[::-1].copy()
+
+
+class SocketTransport(Transport):
+    """
+    本机TCP连接的两端，每一方通过自己的套接字发送分享
+    """
+
+    def __init__(self, latency=0.0, bandwidth=None, host='127.0.0.1'):
+        super().__init__(latency, bandwidth)
+        self.host = host
+        listener = socket.create_server((host, 0))
+        client = socket.create_connection(listener.getsockname())
+        self.sockets = (client, listener.accept()[0])
+        listener.close()
+        for end in self.sockets:
+            end.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def spec(self):
+        return type(self), (self.latency, self.bandwidth, self.host)
+
+    def send(self, shares):
+        # Each party sends from its own thread, so large shares cannot fill both buffers and block
+        senders = [threading.Thread(target=end.sendall, args=(share.tobytes(),)) for end, share in zip(self.sockets, shares)]
+        for sender in senders:
+            sender.start()
+        received = np.empty_like(shares)
+        for party, end in enumerate(self.sockets):
+            buffer = memoryview(received.reshape(len(self.sockets), -1)[party]).cast('B')
+            while buffer:
+                size = end.recv_into(buffer)
+                if not size:
+                    raise ConnectionError('Transport closed by the other party')
+                buffer = buffer[size:]
+        for sender in senders:
+            sender.join()
+        return received
+
+    def close(self):
+        for end in self.sockets:
+            end.close()
@@ -1,52 +1,54 @@
 import numpy as np
 import matplotlib.pyplot as plt
 
-from ss.secret import Secret
+from eACO.secret_matrix import SecretMatrix
 
 # Constants
 fixed_point = 5
 fp = pow(10, fixed_point)
 
 
-def encrypt_2darray(ndarray: np.array):
+def share_2darray(ndarray: np.array, scale=1, block_rows=None):
     """
-    加密numpy数组
+    批量分享numpy数组，每块只调用一次随机数生成
+    block_rows给定时按行块流式分享，避免整个矩阵的临时数组
     """
-    ndarray = (ndarray * fp).astype(np.int64)
-    e_ndarray = np.empty(ndarray.shape, dtype=Secret, order='C')
-    for i in range(ndarray.shape[0]):
-        for j in range(ndarray.shape[1]):
-            e_ndarray[i, j] = Secret(ndarray[i, j])
+    block_rows = block_rows or ndarray.shape[0]
+    e_ndarray = SecretMatrix(np.empty((2,) + ndarray.shape, dtype=np.int64))
+    for start in range(0, ndarray.shape[0], block_rows):
+        e_ndarray[start:start + block_rows] = SecretMatrix.share((ndarray[start:start + block_rows] * scale).astype(np.int64))
     return e_ndarray
 
 
-def r_encrypt_2darray(ndarray: np.array):
+def encrypt_2darray(ndarray: np.array, block_rows=None):
     """
     加密numpy数组
     """
-    ndarray = ndarray.astype(np.int64)
-    e_ndarray = np.empty(ndarray.shape, dtype=Secret, order='C')
-    for i in range(ndarray.shape[0]):
-        for j in range(ndarray.shape[1]):
-            e_ndarray[i, j] = Secret(ndarray[i, j])
-    return e_ndarray
+    return share_2darray(ndarray, fp, block_rows)
+
+
+def r_encrypt_2darray(ndarray: np.array, block_rows=None):
+    """
+    加密numpy数组
+    """
+    return share_2darray(ndarray, 1, block_rows)
 
 
-def decrypt_array(e_array: np.array):
+def decrypt_array(e_array: SecretMatrix):
     """
     解密numpy数组
     """
-    array = np.zeros(e_array.shape)
-    for i in range(array.shape[0]):
-        array[i] = e_array[i].recover() / fp
-    return array
+    return e_array.recover() / fp
 
 
-def decrypt_2darray(e_2darray: np.array):
-    array = np.zeros(e_2darray.shape)
-    for i in range(array.shape[0]):
-        for j in range(array.shape[1]):
-            array[i, j] = e_2darray[i, j].recover() / fp
+def decrypt_2darray(e_2darray: SecretMatrix, block_rows=None):
+    """
+    解密numpy数组，block_rows给定时按行块恢复
+    """
+    block_rows = block_rows or e_2darray.shape[0]
+    array = np.empty(e_2darray.shape)
+    for start in range(0, array.shape[0], block_rows):
+        array[start:start + block_rows] = e_2darray[start:start + block_rows].recover() / fp
     return array
 
 
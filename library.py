@@ -1,6 +1,9 @@
-import random
-
+import collections
+import functools
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from eACO.profiling import Profiler
 
 # [1] TSP
 
@@ -67,56 +70,148 @@ def displayTspHeaders(dict):
         {float} beta {1.0}              -- Beta algorithm parameter, more or less weight to a selected distance
         {float} del_tau {1.0}           -- Delta Tau algorithm parameter, pheromones releasing rate
         {float} rho {0.5}               -- Rho algorithm parameter, pheromones evaporation rate
+        {type} dtype {float64}          -- Floating-point type of the distances and pheromones matrices
+        {int} neighbours {None}         -- Size of the nearest neighbours candidate lists, all nodes if None
+        {Profiler} profiler {None}      -- Collects the time and calls of every phase of the run
+        {int} threads {None}            -- Number of threads moving the colony, the calling thread only if None,
+                                           not supported by the 'acs' engine
+        {float} q0 {0.5}                -- Probability of moving greedily to the best node instead of sampling
+        {string} local_search {None}    -- Improve with 2-opt and Or-opt the 'best' tour of each iteration or 'all'
+                                           the tours, no local search if None
+        {string} engine {'as'}          -- Pheromone update rule: 'as' Ant System, every ant deposits; 'mmas' MAX-MIN
+                                           Ant System, the best ant deposits within bounds; 'acs' Ant Colony System,
+                                           local updates while moving and the global best deposits
+        {float} xi {0.1}                -- Local pheromone update rate of ACS
+        {int} restart {25}              -- Iterations without a better tour before MMAS reinitializes the trail
 
     @return
         {Tuple(numpy.ndarray, float)}   -- Indexes of the minimun distance path and the minimun distance
 """
-def runAcoTsp(space, iterations = 10, colony = 70, alpha = 1, beta = 5.0, del_tau = 1.0, rho = 0.2):
-    # [1] Find inverted distances for all nodes
-    inv_distances = inverseDistances(space)
+def runAcoTsp(space, iterations = 10, colony = 70, alpha = 1, beta = 5.0, del_tau = 1.0, rho = 0.2, dtype = np.float64, neighbours = None, profiler = None, threads = None, q0 = 0.5, local_search = None, engine = 'as', xi = 0.1, restart = 25):
+    if engine not in ('as', 'mmas', 'acs'):
+        raise ValueError('Unknown engine {}'.format(engine))
+
+    # The local update of ACS writes the trail while the ants move, the threads would race on it
+    if engine == 'acs' and threads and threads > 1:
+        raise ValueError('The acs engine moves the colony in the calling thread only, threads must be None or 1')
+
+    # Phases timed even without a profiler to report to
+    profiler = profiler or Profiler()
+
+    with profiler.phase('distance precompute'):
+        # [1] Find distances and inverted distances for all nodes
+        inv_distances, distances = inverseDistances(space, dtype)
+
+        # Add beta algorithm parameter to inverted distances, fixed for the whole run
+        inv_distances = inv_distances ** beta
+
+    # Length of a nearest neighbour tour, the scale of the initial trail of MMAS and ACS
+    if engine != 'as':
+        with profiler.phase('distance precompute'):
+            nearest_distance = tourDistances(nearestNeighbourTour(distances)[None], distances)[0]
 
-    # Add beta algorithm parameter to inverted distances
-    inv_distances = inv_distances ** beta
+    # Empty pheromones trail, at its upper bound under MMAS and at tau0 under ACS
+    pheromones = np.zeros((space.shape[0], space.shape[0]), dtype = dtype) + 50/20012.90299838567
+    if engine == 'mmas':
+        pheromones[...] = del_tau / (rho * nearest_distance)
+    elif engine == 'acs':
+        tau0 = 1 / (space.shape[0] * nearest_distance)
+        pheromones[...] = tau0
 
-    # Empty pheromones trail
-    pheromones = np.zeros((space.shape[0], space.shape[0])) + 50/20012.90299838567
+    # Choice information, pheromones ^ alpha * inverted distances ^ beta
+    choice_info = choiceInformation(pheromones, inv_distances, alpha)
+
+    # Candidate lists of the nearest neighbours of each node
+    with profiler.phase('distance precompute'):
+        candidates = nearestNeighbours(space, neighbours) if neighbours else None
+
+        # Neighbour lists of the local search, the candidate lists if there are any
+        if local_search:
+            search_neighbours = candidates if candidates is not None else nearestNeighbours(space, 10)
+
+    # Local pheromone update of ACS after every step of the ants
+    on_step = functools.partial(localPheromoneUpdate, pheromones, choice_info, inv_distances, alpha, xi, tau0) if engine == 'acs' else None
 
     # Empty minimum distance and path
     min_distance = None
     min_path = None
+    improved = 0
+
+    # Threads moving parts of the colony, alive for the whole run
+    executor = ThreadPoolExecutor(threads) if threads else None
+
+    # Threads released even when the run fails
+    try:
+        # [2] For the number of iterations
+        for i in range(iterations):
+            # Initial random positions
+            positions = initializeAnts(space, colony)
+
+            # Complete a path
+            with profiler.phase('construction'):
+                paths = moveAnts(space, positions, choice_info, candidates, executor, threads, q0 = q0, on_step = on_step)
+
+            # Evaporate pheromones, ACS only evaporates the edges it deposits on
+            if engine != 'acs':
+                with profiler.phase('evaporation'):
+                    pheromones *= (1 - rho)
+
+            # [3] Closed tour distance of every path at once
+            with profiler.phase('tour evaluation'):
+                tour_distances = tourDistances(paths, distances)
+
+            # Improve the iteration best tour, or every tour, before depositing
+            if local_search:
+                with profiler.phase('local search'):
+                    improve = np.arange(colony) if local_search == 'all' else np.argmin(tour_distances)[None]
+                    for ant in improve:
+                        paths[ant] = localSearch(paths[ant], distances, search_neighbours)
+                    tour_distances[improve] = tourDistances(paths[improve], distances)
+
+            # Update minimun distance and path if less nor non-existent
+            best = np.argmin(tour_distances)
+            if not min_distance or tour_distances[best] < min_distance:
+                min_distance = tour_distances[best]
+                min_path = paths[best]
+                improved = i
+
+            with profiler.phase('deposit'):
+                if engine == 'as':
+                    # Update pheromones (releasing pheromones) on every edge of every path
+                    depositPheromones(pheromones, paths, del_tau / tour_distances)
+                elif engine == 'mmas':
+                    # Iteration best deposits, the global best every fifth iteration
+                    if i % 5 == 4:
+                        depositPheromones(pheromones, min_path[None], np.array([del_tau / min_distance]))
+                    else:
+                        depositPheromones(pheromones, paths[best][None], np.array([del_tau / tour_distances[best]]))
+
+                    # Bounds of the trail from the global best, trail reinitialized when stagnating
+                    tau_max = del_tau / (rho * min_distance)
+                    root = 0.05 ** (1 / space.shape[0])
+                    tau_min = tau_max * (1 - root) / ((space.shape[0] / 2 - 1) * root)
+                    if i - improved >= restart:
+                        pheromones[...] = tau_max
+                        improved = i
+                    np.clip(pheromones, tau_min, tau_max, out = pheromones)
+                else:
+                    # Global best evaporates and deposits on its own edges only
+                    rows, cols = min_path, np.roll(min_path, -1)
+                    for edge in ((rows, cols), (cols, rows)):
+                        pheromones[edge] = (1 - rho) * pheromones[edge] + rho * del_tau / min_distance
+
+            # Refresh choice information after evaporation and deposit
+            with profiler.phase('choice information'):
+                choiceInformation(pheromones, inv_distances, alpha, out = choice_info)
+
+            print(i, "th:", min_distance)
+    finally:
+        if executor:
+            executor.shutdown()
+
+    # Copy and append first node to end of minimum path to form closed path
+    min_path = np.append(min_path, min_path[0])
 
-    # [2] For the number of iterations
-    for i in range(iterations):
-        # Initial random positions
-        positions = initializeAnts(space, colony)
-
-        # Complete a path
-        paths = moveAnts(space, positions, inv_distances, pheromones, alpha, beta, del_tau)
-
-        # Evaporate pheromones
-        pheromones *= (1 - rho)
-
-        # [3] For each path
-        for path in paths:
-            # Empty distance
-            distance = 0
-
-            # For each node from second to last
-            for node in range(1, path.shape[0]):
-                # Calculate distance to the last node
-                distance += np.sqrt(((space[int(path[node])] - space[int(path[node - 1])]) ** 2).sum())
-            print(distance)
-            for node in range(1, path.shape[0]):
-                # Update pheromones (releasing pheromones)
-                pheromones[path[node], path[node - 1]] += 1 / distance
-                pheromones[path[node - 1], path[node]] += 1 / distance
-            if not min_distance or distance < min_distance:
-                min_distance = distance
-                min_path = path
-
-        # Copy and append first node to end of minimum path to form closed path
-        min_path = np.append(min_path, min_path[0])
-        print(i, "th:", min_distance)
     # Return tuple
     return (min_path, min_distance)
 
@@ -124,17 +219,30 @@ def runAcoTsp(space, iterations = 10, colony = 70, alpha = 1, beta = 5.0, del_ta
     Inverse distance - Get an array of inverted distances
     @arg
         {numpy.ndarray} space   -- The space
+        {type} dtype {float64}  -- Floating-point type of the arrays, float32 halves the memory
+        {int} chunk {None}      -- Number of rows computed per block, all rows at once if None
 
     @return
-        {numpy.ndarray}         -- A space.dimension per space.dimension array of inverse distances
+        {Tuple(numpy.ndarray, numpy.ndarray)}   -- space.dimension per space.dimension arrays of inverse distances and distances
 """
-def inverseDistances(space):
+def inverseDistances(space, dtype = np.float64, chunk = None):
+    # Coordinates in the requested precision
+    space = np.asarray(space, dtype = dtype)
+
+    # Rows computed per block, all of them at once by default
+    chunk = chunk or space.shape[0]
+
     # Empty multidimensional array (matriz) to distances
-    distances = np.zeros((space.shape[0], space.shape[0]))
+    distances = np.empty((space.shape[0], space.shape[0]), dtype = dtype)
 
-    # Calculate distance to all nodes to all nodes
-    for index, point in enumerate(space):
-        distances[index] = np.sqrt(((space - point) ** 2).sum(axis = 1))
+    # Calculate distance to all nodes from a block of nodes, one coordinate at a time
+    for start in range(0, space.shape[0], chunk):
+        block = distances[start:start + chunk]
+        block[:] = 0
+        for axis in range(space.shape[1]):
+            delta = np.subtract.outer(space[start:start + chunk, axis], space[:, axis])
+            block += np.square(delta, out = delta)
+        np.sqrt(block, out = block)
 
     # Floating-point error handling - Setted to known state
     with np.errstate(all = 'ignore'):
@@ -144,8 +252,112 @@ def inverseDistances(space):
     # Replace infinity by zero to prevent zero division error
     inv_distances[inv_distances == np.inf] = 0
 
-    # Eta algorithm result, inverted distances
-    return inv_distances
+    # Eta algorithm result, inverted distances, and the distances to evaluate tours
+    return inv_distances, distances
+
+"""
+    Tour distances - Get the closed tour distance of each path
+    @arg
+        {numpy.ndarray} paths       -- Indexes of the paths taken by the ants
+        {numpy.ndarray} distances   -- Distances between all nodes
+
+    @return
+        {numpy.ndarray}             -- Distance of each path, including the edge back to its first node
+"""
+def tourDistances(paths, distances):
+    # Gather the distance of every edge (node to next node, last node back to first) and add them up
+    return distances[paths, np.roll(paths, -1, axis = 1)].sum(axis = 1)
+
+"""
+    Choice information - Get the combined weight of pheromones and heuristic of every edge
+    @arg
+        {numpy.ndarray} pheromones          -- Tau, pheromones trail
+        {numpy.ndarray} inv_distances       -- Eta, inverted distances ^ beta
+        {float} alpha                       -- Alpha algorithm parameter, more or less weight to the pheromones
+        {numpy.ndarray} out {None}          -- Choice information array to update in place
+
+    @return
+        {numpy.ndarray}                     -- A space.dimension per space.dimension array of tau ^ alpha * eta ^ beta
+"""
+def choiceInformation(pheromones, inv_distances, alpha, out = None):
+    # Pheromones ^ alpha, written into the given array if any
+    choice_info = np.power(pheromones, alpha, out = out)
+
+    # Weight by the heuristic information
+    choice_info *= inv_distances
+
+    return choice_info
+
+"""
+    Local pheromone update - Move the trail of the edges just taken towards tau0, as Ant Colony System does while the
+    ants move, and refresh their choice information
+    @arg
+        {numpy.ndarray} pheromones      -- Tau, pheromones trail, updated in place
+        {numpy.ndarray} choice_info     -- Choice information, updated in place
+        {numpy.ndarray} inv_distances   -- Inverted distances ^ beta
+        {float} alpha                   -- Alpha algorithm parameter, more or less weight to a selected distance
+        {float} xi                      -- Local update rate
+        {float} tau0                    -- Initial pheromone level
+        {numpy.ndarray} current         -- Node each ant moved from
+        {numpy.ndarray} next_position   -- Node each ant moved to
+"""
+def localPheromoneUpdate(pheromones, choice_info, inv_distances, alpha, xi, tau0, current, next_position):
+    # Both directions of each edge
+    for edge in ((current, next_position), (next_position, current)):
+        pheromones[edge] = (1 - xi) * pheromones[edge] + xi * tau0
+        choice_info[edge] = pheromones[edge] ** alpha * inv_distances[edge]
+
+"""
+    Nearest neighbour tour - Get the tour that always moves to the nearest node not visited yet
+    @arg
+        {numpy.ndarray} distances   -- Distances between all nodes
+        {int} start {0}             -- Index of the first node
+
+    @return
+        {numpy.ndarry}              -- Indexes of the nodes of the tour, in order
+"""
+def nearestNeighbourTour(distances, start = 0):
+    # Empty tour and visited nodes
+    tour = np.zeros(distances.shape[0], dtype = int)
+    tour[0] = start
+    visited = np.zeros(distances.shape[0], dtype = bool)
+    visited[start] = True
+
+    # Nearest node not visited yet, one node at a time
+    for node in range(1, distances.shape[0]):
+        tour[node] = np.argmin(np.where(visited, np.inf, distances[tour[node - 1]]))
+        visited[tour[node]] = True
+
+    return tour
+
+"""
+    Deposit pheromones - Release pheromones on every edge of the given paths in a single scatter-add
+    @arg
+        {numpy.ndarray} pheromones          -- Tau, pheromones trail, updated in place
+        {numpy.ndarray} paths               -- Indexes of the paths taken by the ants
+        {numpy.ndarray} deposits            -- Amount of pheromones released on each edge of each path
+
+    @return
+        {numpy.ndarray}                     -- The updated pheromones trail
+"""
+def depositPheromones(pheromones, paths, deposits):
+    # Edges of the closed tours, node to next node and last node back to first
+    rows = paths.ravel()
+    cols = np.roll(paths, -1, axis = 1).ravel()
+
+    # Same amount on every edge of a path
+    weights = np.repeat(deposits, paths.shape[1])
+
+    # Both directions of each edge, as flat indexes
+    nodes = pheromones.shape[0]
+    index = np.concatenate((rows * nodes + cols, cols * nodes + rows))
+    weights = np.concatenate((weights, weights))
+
+    # Accumulate repeated edges, then add them once to the edges of the paths only
+    edges, inverse = np.unique(index, return_inverse = True)
+    pheromones[np.divmod(edges, nodes)] += np.bincount(inverse, weights = weights)
+
+    return pheromones
 
 """
     Initialize ants - Get an array of random initial positions of the ants in space
@@ -165,46 +377,323 @@ def initializeAnts(space, colony):
     @arg
         {numpy.ndarray} space           -- The space
         {numpy.ndarray} positions       -- Indexes of initial positions of ants in the space
-        {numpy.ndarray} inv_distances   -- Inverted distances ^ beta
-        {numpy.ndarray} pheromones      -- Tau, pheromones trail
-        {float} alpha                   -- Alpha algorithm parameter, more or less weight to a selected distance
-        {float} beta                    -- Beta algorithm parameter, more or less weight to a selected distance
-        {float} del_tau                 -- Delta Tau algorithm parameter, pheromones releasing rate
+        {numpy.ndarray} choice_info     -- Choice information, pheromones ^ alpha * inverted distances ^ beta
+        {numpy.ndarray} candidates {None} -- Candidate lists, indexes of the nearest neighbours of each node
+        {ThreadPoolExecutor} executor {None} -- Threads moving parts of the colony, the calling thread if None
+        {int} threads {1}               -- Number of parts the colony is split into for the executor
+        {Generator} rng {None}          -- Random generator of the ants, seeded from the global numpy one if None
+        {float} q0 {0.5}                -- Probability of moving greedily to the best node instead of sampling
+        {function} on_step {None}       -- Called with the current and the next node of every ant after each step,
+                                           from the threads moving the parts if any, so it must not write shared arrays
 
     @return
         {numpy.ndarry}                  -- Indexes of the paths taken by the ants
 """
-def moveAnts(space, positions, inv_distances, pheromones, alpha, beta, del_tau):
+def moveAnts(space, positions, choice_info, candidates = None, executor = None, threads = 1, rng = None, q0 = 0.5, on_step = None):
+    # Split the colony across the threads, sharing the read-only arrays and each part with its own generator
+    if executor and threads > 1:
+        parts = np.array_split(positions, threads)
+        seeds = np.random.randint(2 ** 31, size = len(parts))
+        futures = [executor.submit(moveAnts, space, part, choice_info, candidates, rng = np.random.default_rng(seed), q0 = q0, on_step = on_step)
+                   for part, seed in zip(parts, seeds) if part.shape[0]]
+        return np.concatenate([future.result() for future in futures])
+
+    # Generator seeded from the global numpy one by default, so that seeded runs repeat
+    rng = rng or np.random.default_rng(np.random.randint(2 ** 31))
+
+    # Number of nodes and index of each ant
+    nodes = space.shape[0]
+    ants = np.arange(positions.shape[0])
+
     # Empty multidimensional array (matriz) to paths
-    paths = np.zeros((space.shape[0], positions.shape[0]), dtype = int) - 1
+    paths = np.zeros((nodes, positions.shape[0]), dtype = int) - 1
 
     # Initial position at node zero
     paths[0] = positions
 
-    # For nodes after start to end
-    for node in range(1, space.shape[0]):
-        # For each ant
-        for ant in range(positions.shape[0]):
-            # Probability to travel the nodes
-            next_location_probability = (
-                    ((inv_distances[positions[ant]] ** alpha) * (pheromones[positions[ant]] ** beta)) /
-                    ((inv_distances[positions[ant]] ** alpha) * (pheromones[positions[ant]] ** beta)).sum()
-                                         )
+    # Visited nodes bitmap, one row per ant, updated in place as the ants move
+    visited = np.zeros((positions.shape[0], nodes), dtype = bool)
+    visited[ants, positions] = True
+
+    # For nodes after start to end, moving the whole colony one node at a time
+    for node in range(1, nodes):
+        # Current node of every ant
+        current = paths[node - 1]
+
+        if candidates is None:
+            # Probability to travel the nodes, one row per ant
+            next_position = chooseNodes(choice_info[current], ~visited, rng, q0)
+        else:
+            # Probability to travel the candidate nodes of the current node, one row per ant
+            options = candidates[current]
+            allowed = ~visited[ants[:, None], options]
+            next_position = options[ants, chooseNodes(choice_info[current[:, None], options], allowed, rng, q0)]
+
+            # Ants whose candidates have all been visited fall back to the full set of nodes
+            stuck = ~allowed.any(axis = 1)
+            if stuck.any():
+                next_position[stuck] = chooseNodes(choice_info[current[stuck]], ~visited[stuck], rng, q0)
+
+        # Add nodes to paths and mark them as visited
+        paths[node] = next_position
+        visited[ants, next_position] = True
+
+        # Update the edges just taken
+        if on_step:
+            on_step(current, next_position)
 
-            # Index to maximum probability node
-            next_position = np.argmax(next_location_probability) if random.randint(0, 1) == 1  else random.randint(0, next_location_probability.shape[0] -1)
+    # Paths taken by the ants
+    return np.swapaxes(paths, 0, 1)
 
+"""
+    Choose nodes - Choose the next node of each ant from a block of probabilities, with the pseudo-random-proportional
+    rule: the best allowed node with probability q0, otherwise a node sampled in proportion to its probability
+    @arg
+        {numpy.ndarray} next_location_probability   -- Probability to travel each node, one row per ant (unnormalized)
+        {numpy.ndarray} allowed                     -- Nodes each ant is allowed to travel
+        {Generator} rng                             -- Random generator, a single call draws all the numbers
+        {float} q0 {0.5}                            -- Probability of choosing the best node greedily
 
-            # Check if node has already been visited
-            while next_position in paths[:, ant]:
-                # Replace the probability of visited to zero
-                next_location_probability[next_position] = 0.0
+    @return
+        {numpy.ndarry}                              -- Column of the chosen node for each ant
+"""
+def chooseNodes(next_location_probability, allowed, rng, q0 = 0.5):
+    # Index of each ant and number of nodes in a row
+    ants = np.arange(next_location_probability.shape[0])
+    nodes = next_location_probability.shape[1]
 
-                # Find the maximum probability node
-                next_position = np.argwhere(next_location_probability == np.amax(next_location_probability))[0][0]
+    # Probability of not allowed nodes set to zero, so that they are never sampled
+    weights = np.where(allowed, next_location_probability, 0)
 
-            # Add node to path
-            paths[node, ant] = next_position
+    # Index to maximum probability node among the allowed ones
+    greedy = np.argmax(np.where(allowed, next_location_probability, -1.0), axis = 1)
 
-    # Paths taken by the ants
-    return np.swapaxes(paths, 0, 1)
+    # Both random numbers of every ant at once, the greedy coin and the roulette wheel
+    coin, wheel = rng.random((2, ants.shape[0]))
+
+    # Roulette wheel of every ant at once, cumulative probabilities normalized per row and offset by the row index
+    cumulative = np.cumsum(weights, axis = 1)
+    totals = cumulative[:, -1].copy()
+    np.divide(cumulative, totals[:, None], out = cumulative, where = totals[:, None] > 0)
+    cumulative += ants[:, None]
+    sampled = np.searchsorted(cumulative.ravel(), wheel + ants, side = 'right') - ants * nodes
+
+    # Samples outside the row or on a node not allowed, only possible through rounding, are never taken
+    inside = (sampled >= 0) & (sampled < nodes)
+    sampled = np.where(inside, sampled, greedy)
+    sampled = np.where(allowed[ants, sampled], sampled, greedy)
+
+    # Greedy under the q0 rule, and for the ants with nothing to sample
+    return np.where((coin < q0) | ~(totals > 0), greedy, sampled)
+
+"""
+    Nearest neighbours - Get the candidate list of the k nearest neighbours of each node using a uniform grid
+    @arg
+        {numpy.ndarray} space   -- The space
+        {int} k                 -- Number of neighbours per node
+
+    @return
+        {numpy.ndarry}          -- A space.dimension per k array of indexes of the nearest neighbours, nearest first
+"""
+def nearestNeighbours(space, k):
+    # Never more neighbours than other nodes
+    nodes = space.shape[0]
+    k = min(k, nodes - 1)
+
+    # Uniform grid with about two nodes per cell
+    cells = max(1, int(np.sqrt(nodes / 2)))
+    low = space.min(axis = 0)
+    size = (space.max(axis = 0) - low).max() / cells or 1.0
+    coords = np.minimum(((space - low) / size).astype(int), cells - 1)
+    cell = coords[:, 0] * cells + coords[:, 1]
+
+    # Nodes sorted by cell, and where each cell starts in that order
+    order = np.argsort(cell, kind = 'stable')
+    starts = np.searchsorted(cell[order], np.arange(cells * cells + 1))
+
+    # Empty candidate lists
+    neighbours = np.zeros((nodes, k), dtype = int)
+
+    # For each non-empty cell
+    for index in np.unique(cell):
+        members = order[starts[index]:starts[index + 1]]
+        x, y = divmod(index, cells)
+
+        # Grow a square ring of cells around it until the k nearest are certainly inside
+        ring = 1
+        while True:
+            # Nodes in the ring, one contiguous run of cells per grid row
+            y0, y1 = max(y - ring, 0), min(y + ring, cells - 1)
+            found = np.concatenate([
+                order[starts[row * cells + y0]:starts[row * cells + y1 + 1]]
+                for row in range(max(x - ring, 0), min(x + ring, cells - 1) + 1)
+            ])
+
+            # Squared distances from the members, excluding each member itself
+            squared = ((space[members, None, :] - space[found]) ** 2).sum(axis = 2)
+            squared[members[:, None] == found] = np.inf
+
+            # Nodes outside the ring are at least ring cells away
+            covered = ring >= max(x, y, cells - 1 - x, cells - 1 - y)
+            if covered or (found.shape[0] > k and (np.partition(squared, k - 1, axis = 1)[:, k - 1] <= (ring * size) ** 2).all()):
+                break
+            ring += 1
+
+        # Nearest k nodes of each member
+        neighbours[members] = found[np.argsort(squared, axis = 1)[:, :k]]
+
+    return neighbours
+
+"""
+    Local search - Improve a tour with 2-opt and Or-opt moves until no move improves it
+    Moves are only looked for around each node's nearest neighbours, and nodes whose surroundings did not change
+    since they last failed to improve keep their don't-look bit set
+    @arg
+        {numpy.ndarray} tour        -- Indexes of the nodes of the tour, in order
+        {numpy.ndarray} distances   -- Distances between all nodes
+        {numpy.ndarray} neighbours  -- Nearest neighbours of each node, nearest first
+        {int} segment {3}           -- Longest segment moved by Or-opt
+
+    @return
+        {numpy.ndarry}              -- Indexes of the nodes of the improved tour
+"""
+def localSearch(tour, distances, neighbours, segment = 3):
+    # Array tour and position of each node in it
+    tour = np.array(tour)
+    position = np.empty(tour.shape[0], dtype = int)
+    position[tour] = np.arange(tour.shape[0])
+
+    # Nodes without their don't-look bit, in the order to look at them
+    active = np.ones(tour.shape[0], dtype = bool)
+    queue = collections.deque(tour.tolist())
+
+    while queue:
+        a = queue.popleft()
+        active[a] = False
+
+        # Endpoints of the changed edges look again
+        changed = twoOptMove(tour, position, distances, neighbours, a) or orOptMove(tour, position, distances, neighbours, a, segment)
+        for node in changed or []:
+            if not active[node]:
+                active[node] = True
+                queue.append(node)
+
+    return tour
+
+"""
+    2-opt move - Apply the first improving 2-opt move that replaces an edge of a node by an edge to one of its neighbours
+    @arg
+        {numpy.ndarray} tour        -- Indexes of the nodes of the tour, updated in place
+        {numpy.ndarray} position    -- Position of each node in the tour, updated in place
+        {numpy.ndarray} distances   -- Distances between all nodes
+        {numpy.ndarray} neighbours  -- Nearest neighbours of each node, nearest first
+        {int} a                     -- Node to look at
+
+    @return
+        {list}                      -- Endpoints of the changed edges, None if no move improves the tour
+"""
+def twoOptMove(tour, position, distances, neighbours, a):
+    nodes = tour.shape[0]
+    if nodes < 5:
+        return None
+
+    # Edge to the successor, then edge to the predecessor
+    for forward in (True, False):
+        i = position[a]
+        b = tour[(i + 1) % nodes] if forward else tour[i - 1]
+
+        for c in neighbours[a]:
+            # Neighbours are sorted, none further can give a shorter new edge
+            if distances[a, c] >= distances[a, b]:
+                break
+            j = position[c]
+            d = tour[(j + 1) % nodes] if forward else tour[j - 1]
+            if c == b or d == a:
+                continue
+
+            # Replace (a, b) and (c, d) with (a, c) and (b, d)
+            delta = distances[a, c] + distances[b, d] - distances[a, b] - distances[c, d]
+            if delta < -1e-10:
+                if forward:
+                    reverseSegment(tour, position, (i + 1) % nodes, j)
+                else:
+                    reverseSegment(tour, position, i, (j - 1) % nodes)
+                return [a, b, c, d]
+
+    return None
+
+"""
+    Or-opt move - Apply the first improving move of a segment starting at a node, in either orientation, next to a
+    neighbour of one of its ends
+    @arg
+        {numpy.ndarray} tour        -- Indexes of the nodes of the tour, updated in place
+        {numpy.ndarray} position    -- Position of each node in the tour, updated in place
+        {numpy.ndarray} distances   -- Distances between all nodes
+        {numpy.ndarray} neighbours  -- Nearest neighbours of each node, nearest first
+        {int} a                     -- First node of the segments
+        {int} segment {3}           -- Longest segment to move
+
+    @return
+        {list}                      -- Endpoints of the changed edges, None if no move improves the tour
+"""
+def orOptMove(tour, position, distances, neighbours, a, segment = 3):
+    nodes = tour.shape[0]
+    if nodes < segment + 3:
+        return None
+    i = position[a]
+
+    for k in range(1, segment + 1):
+        # Segment of k nodes from a, and the nodes around it
+        moved = tour[(i + np.arange(k)) % nodes]
+        first, last = a, moved[-1]
+        previous, following = tour[i - 1], tour[(i + k) % nodes]
+
+        # Length saved by taking the segment out
+        removal = distances[previous, first] + distances[last, following] - distances[previous, following]
+        if removal <= 0:
+            continue
+
+        for end in (first, last):
+            for c in neighbours[end]:
+                # Neighbours are sorted, none further can save length
+                if distances[end, c] >= removal:
+                    break
+                if c in moved:
+                    continue
+
+                # Edges of the neighbour the segment could go into
+                j = position[c]
+                for x, y in ((tour[j - 1], c), (c, tour[(j + 1) % nodes])):
+                    if x in moved or y in moved:
+                        continue
+                    straight = distances[x, first] + distances[last, y]
+                    backward = distances[x, last] + distances[first, y]
+                    if min(straight, backward) - distances[x, y] - removal < -1e-10:
+                        # Rest of the tour after the segment, with the segment put back right after x
+                        rest = tour[(i + k + np.arange(nodes - k)) % nodes]
+                        at = (position[x] - i - k) % nodes + 1
+                        tour[:] = np.concatenate((rest[:at], moved if straight <= backward else moved[::-1], rest[at:]))
+                        position[tour] = np.arange(nodes)
+                        return [previous, following, x, y, first, last]
+
+    return None
+
+"""
+    Reverse segment - Reverse the nodes of a tour between two positions, or the rest of the tour when it is shorter
+    @arg
+        {numpy.ndarray} tour        -- Indexes of the nodes of the tour, updated in place
+        {numpy.ndarray} position    -- Position of each node in the tour, updated in place
+        {int} start                 -- Position of the first node of the segment
+        {int} end                   -- Position of the last node of the segment, wrapping around the tour
+"""
+def reverseSegment(tour, position, start, end):
+    nodes = tour.shape[0]
+    length = (end - start) % nodes + 1
+
+    # The same tour in the other direction, reversing the shorter side
+    if 2 * length > nodes:
+        start, end, length = (end + 1) % nodes, (start - 1) % nodes, nodes - length
+
+    index = (start + np.arange(length)) % nodes
+    tour[index] = tour[index[::-1]]
+    position[tour[index]] = index
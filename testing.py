@@ -1,17 +1,35 @@
 # Import
+from concurrent.futures import ProcessPoolExecutor
 from library import *
 import matplotlib.pyplot as plt
 
 """
     Run Ant Colony Optimization (ACO) algorithm for a given Symmetric traveling salesman problem (TSP)
     @arg
-        {string} tsp    -- The TSP file src name (located in /data folder)
+        {string} tsp            -- The TSP file src name (located in /data folder)
+        {int} processes {None}  -- Number of processes running the repetitions, the CPU count if None
+        {int} seed {None}       -- Seed of the repetitions, fresh entropy if None
 
     @export
-        {results}       -- Generated files for results
-        {plots}         -- Generated files for plots
+        {results}               -- Generated files for results
+        {plots}                 -- Generated files for plots
 """
-def test(tsp):
+def test(tsp, processes = None, seed = None):
+    testAll([tsp], processes, seed)
+
+"""
+    Run Ant Colony Optimization (ACO) algorithm for several Symmetric traveling salesman problems (TSP), every
+    repetition of every problem as an independent job of a process pool
+    @arg
+        {list} tsps             -- The TSP file src names (located in /data folder)
+        {int} processes {None}  -- Number of processes running the jobs, the CPU count if None
+        {int} seed {None}       -- Seed of the jobs, fresh entropy if None
+
+    @export
+        {results}               -- Generated files for results, once all the jobs are done
+        {plots}                 -- Generated files for plots, once all the jobs are done
+"""
+def testAll(tsps, processes = None, seed = None):
     # Default arguments
     '''
         iterations {80}     -- Number of iterations (Ending condition)
@@ -32,33 +50,50 @@ def test(tsp):
     beta = 1
     del_tau = 1.0
     rho = 0.5
-
-    results = np.zeros(n)   # Store
+    parameters = (iterations, colony, alpha, beta, del_tau, rho)
 
     # Get TSP data
-    src = getTspData('data/{}.tsp'.format(tsp))
-    space = None
-    space = np.array(src['node_coord_section'])
+    sources = {tsp: getTspData('data/{}.tsp'.format(tsp)) for tsp in tsps}
+    spaces = {tsp: np.array(src['node_coord_section']) for tsp, src in sources.items()}
 
-    # Inform
-    msg('Computing {} times for {}'.format(n, tsp))
-
-    # Save space plot
-    saveSpacePlot(tsp, space)
+    # Independent random stream of every (instance, repetition) job
+    jobs = [(tsp, i) for tsp in tsps for i in range(n)]
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(len(jobs))]
 
-    # Repeat and save path plot for each result
-    for i in range(n):
-        # Run
-        min_path, min_distance = runAcoTsp(space, iterations, colony, alpha, beta, del_tau, rho)
+    # Inform
+    msg('Computing {} times for {} in {} jobs'.format(n, ', '.join(tsps), len(jobs)))
+
+    # Run every job in the pool
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(runJob, spaces[tsp], parameters, job_seed) for (tsp, i), job_seed in zip(jobs, seeds)]
+        outcomes = [future.result() for future in futures]
+
+    # Save plots and results once every job is done
+    for tsp in tsps:
+        results = np.zeros(n)   # Store
+        saveSpacePlot(tsp, spaces[tsp])
+        for (job_tsp, i), (min_path, min_distance) in zip(jobs, outcomes):
+            if job_tsp == tsp:
+                results[i] = min_distance
+                savePathPlot(i, n, tsp, spaces[tsp], min_path, min_distance)
+        saveResultsTxt(sources[tsp], results, iterations, colony, alpha, beta, del_tau, rho)
 
-        # Store result
-        results[i] = min_distance
+"""
+    Run a single repetition, the job of a pool process
+    @arg
+        {numpy.ndarray} space   -- The space
+        {tuple} parameters      -- Positional parameters of runAcoTsp after the space
+        {int} seed              -- Seed of the random stream of the job
 
-        # Save path plot
-        savePathPlot(i, n, tsp, space, min_path, min_distance)
+    @return
+        {Tuple(numpy.ndarray, float)}   -- Indexes of the minimun distance path and the minimun distance
+"""
+def runJob(space, parameters, seed):
+    # Random stream of this job only
+    np.random.seed(seed)
 
-    # Save results txt
-    saveResultsTxt(src, results, iterations, colony, alpha, beta, del_tau, rho)
+    # Run
+    return runAcoTsp(space, *parameters)
 
 """
     Save Space plot
@@ -187,9 +222,8 @@ def msg(str):
         {string} str
 """
 def main():
-    # Test for each stored TSP data
-    test('kroA100')
-    test('berlin52')
+    # Test for each stored TSP data, all the repetitions in parallel
+    testAll(['kroA100', 'berlin52'])
 
     # Inform
     msg('All files generated, see /results for details')